@@ -3,58 +3,66 @@
 # To debug replace all "&>/dev/nul" with "1> /dev/null"
 
 # Cleaning the TTY.
-clear
+printf '\e[H\e[2J\e[3J'
 setfont ter-v22b
 
-# Cosmetics (colours for text).
-BOLD='\e[1m'
-BRED='\e[91m'
-BBLUE='\e[34m'
-BGREEN='\e[92m'
-BYELLOW='\e[93m'
-RESET='\e[0m'
-
-# Pretty print (function).
+# Cosmetics (colours for text, escapes resolved once here).
+BOLD=$'\e[1m'
+BRED=$'\e[91m'
+BBLUE=$'\e[34m'
+BGREEN=$'\e[92m'
+BYELLOW=$'\e[93m'
+RESET=$'\e[0m'
+
+# Message prefixes, composed once from the colours above.
+INTRO_PREFIX="${BOLD}${BGREEN}"
+INFO_PREFIX="${BOLD}${BGREEN}[ ${BYELLOW}•${BGREEN} ] "
+INPUT_PREFIX="${BOLD}${BYELLOW}[ ${BGREEN}•${BYELLOW} ] "
+ERROR_PREFIX="${BOLD}${BRED}[ ${BBLUE}•${BRED} ] "
+
+# Pretty print, each argument on its own line (function).
 intro_print () {
-    echo -e "${BOLD}${BGREEN}$1${RESET}"
+    printf "${INTRO_PREFIX}%s${RESET}\n" "$@"
 }
 
+# Prints each argument as its own line (function).
 info_print () {
-    echo -e "${BOLD}${BGREEN}[ ${BYELLOW}•${BGREEN} ] $1${RESET}"
+    printf "${INFO_PREFIX}%s${RESET}\n" "$@"
 }
 
 # Pretty print for input (function).
 input_print () {
-    echo -ne "${BOLD}${BYELLOW}[ ${BGREEN}•${BYELLOW} ] $1${RESET}"
+    printf "${INPUT_PREFIX}%s${RESET}" "$1"
 }
 
 # Alert user of bad input (function).
 error_print () {
-    echo -e "${BOLD}${BRED}[ ${BBLUE}•${BRED} ] $1${RESET}"
+    printf "${ERROR_PREFIX}%s${RESET}\n" "$1"
 }
 
+# Kernel flavors with their descriptions, the menu entry N selects kernels[N-1].
+kernels=(linux linux-hardened linux-lts linux-zen)
+kernel_descriptions=(
+    "Stable:     Vanilla Linux kernel with a few specific Arch Linux patches applied"
+    "Hardened:   A security-focused Linux kernel"
+    "Longterm:   Long-term support (LTS) Linux kernel"
+    "Zen Kernel: A Linux kernel optimized for desktop usage"
+)
+kernel_menu=("List of kernels:" "================")
+for i in "${!kernels[@]}"; do
+    kernel_menu+=("$((i + 1))) ${kernel_descriptions[i]}")
+done
+
 # Selecting the kernel flavor to install.
 kernel_selector () {
-    info_print "List of kernels:"
-    info_print "================"
-    info_print "1) Stable:     Vanilla Linux kernel with a few specific Arch Linux patches applied"
-    info_print "2) Hardened:   A security-focused Linux kernel"
-    info_print "3) Longterm:   Long-term support (LTS) Linux kernel"
-    info_print "4) Zen Kernel: A Linux kernel optimized for desktop usage"
+    info_print "${kernel_menu[@]}"
     input_print "Please select the number of the corresponding kernel (e.g. 1): "
     read -r choice
-    case $choice in
-        1 ) kernel=linux
-            ;;
-        2 ) kernel=linux-hardened
-            ;;
-        3 ) kernel=linux-lts
-            ;;
-        4 ) kernel=linux-zen
-            ;;
-        * ) error_print "You did not enter a valid kernel, please try again."
-            return 1
-    esac
+    if [[ ! "$choice" =~ ^[1-9]$ ]] || (( choice > ${#kernels[@]} )); then
+        error_print "You did not enter a valid kernel, please try again."
+        return 1
+    fi
+    kernel="${kernels[choice - 1]}"
 }
 
 # Virtualization check (function).
@@ -67,8 +75,7 @@ virt_check () {
                 ;;
         vmware  )   info_print "VMWare Workstation/ESXi has been detected, setting up guest tools."
                     pacstrap /mnt open-vm-tools >/dev/null
-                    systemctl enable vmtoolsd --root=/mnt &>/dev/null
-                    systemctl enable vmware-vmblock-fuse --root=/mnt &>/dev/null
+                    systemctl enable vmtoolsd vmware-vmblock-fuse --root=/mnt &>/dev/null
                     ;;
         oracle )    info_print "VirtualBox has been detected, setting up guest tools."
                     pacstrap /mnt virtualbox-guest-utils &>/dev/null
@@ -76,35 +83,39 @@ virt_check () {
                     ;;
         microsoft ) info_print "Hyper-V has been detected, setting up guest tools."
                     pacstrap /mnt hyperv &>/dev/null
-                    systemctl enable hv_fcopy_daemon --root=/mnt &>/dev/null
-                    systemctl enable hv_kvp_daemon --root=/mnt &>/dev/null
-                    systemctl enable hv_vss_daemon --root=/mnt &>/dev/null
+                    systemctl enable hv_fcopy_daemon hv_kvp_daemon hv_vss_daemon --root=/mnt &>/dev/null
                     ;;
         * )         info_print "No virtualisation detected."
                     ;;
     esac
 }
 
-# User enters a password for the LUKS Container (function).
-lukspass_selector () {
-    input_print "Please enter a password for the LUKS container (password not visible): "
-    read -r -s password
-    if [[ -z "$password" ]]; then
-        echo
-        error_print "You need to enter a password for the LUKS Container, please try again."
+# User enters a password twice, $1 names the variable to set and $2 what it is for (function).
+password_selector () {
+    local -n pass=$1
+    local pass2
+    input_print "Please enter a password for $2 (password not visible): "
+    read -r -s pass
+    echo
+    if [[ -z "$pass" ]]; then
+        error_print "You need to enter a password for $2, please try again."
         return 1
     fi
+    input_print "Please enter the password again (password not visible): "
+    read -r -s pass2
     echo
-    input_print "Please enter the password for the LUKS container again (password not visible): "
-    read -r -s password2
-    echo
-    if [[ "$password" != "$password2" ]]; then
+    if [[ "$pass" != "$pass2" ]]; then
         error_print "Passwords don't match, please try again."
         return 1
     fi
     return 0
 }
 
+# User enters a password for the LUKS Container (function).
+lukspass_selector () {
+    password_selector password "the LUKS container"
+}
+
 # Setting up a password for the user account (function).
 userpass_selector () {
     input_print "Please enter name for a user account (enter empty to not create one): "
@@ -112,53 +123,31 @@ userpass_selector () {
     if [[ -z "$username" ]]; then
         return 0
     fi
-    input_print "Please enter a password for $username (password not visible): "
-    read -r -s userpass
-    if [[ -z "$userpass" ]]; then
-        echo
-        error_print "You need to enter a password for $username, please try again."
-        return 1
-    fi
-    echo
-    input_print "Please enter the password again (password not visible): "
-    read -r -s userpass2
-    echo
-    if [[ "$userpass" != "$userpass2" ]]; then
-        echo
-        error_print "Passwords don't match, please try again."
-        return 1
-    fi
-    return 0
+    password_selector userpass "$username"
 }
 
 # Setting up a password for the root account (function).
 rootpass_selector () {
-    input_print "Please enter a password for the root user (password not visible): "
-    read -r -s rootpass
-    if [[ -z "$rootpass" ]]; then
-        echo
-        error_print "You need to enter a password for the root user, please try again."
-        return 1
-    fi
-    echo
-    input_print "Please enter the password again (password not visible): "
-    read -r -s rootpass2
-    echo
-    if [[ "$rootpass" != "$rootpass2" ]]; then
-        error_print "Passwords don't match, please try again."
-        return 1
-    fi
-    return 0
+    password_selector rootpass "the root user"
 }
 
+# Vendor name and microcode package per CPU vendor_id, anything else gets the Intel microcode.
+declare -A microcodes=([AuthenticAMD]="AMD amd-ucode" [GenuineIntel]="Intel intel-ucode")
+
 # Microcode detector (function).
 microcode_detector () {
-    CPU=$(grep vendor_id /proc/cpuinfo)
-    if [[ "$CPU" == *"AuthenticAMD"* ]]; then
-        info_print "An AMD CPU has been detected, the AMD microcode will be installed."
-        microcode="amd-ucode"
+    local vendor
+    while read -r key _ value; do
+        if [[ "$key" == "vendor_id" ]]; then
+            CPU="$value"
+            break
+        fi
+    done < /proc/cpuinfo
+    if [[ -n "$CPU" && -n "${microcodes[$CPU]}" ]]; then
+        read -r vendor microcode <<< "${microcodes[$CPU]}"
+        info_print "An $vendor CPU has been detected, the $vendor microcode will be installed."
     else
-        info_print "An Intel CPU has been detected, the Intel microcode will be installed."
+        info_print "The CPU vendor was not recognised, falling back to the Intel microcode (intel-ucode)."
         microcode="intel-ucode"
     fi
 }
@@ -174,18 +163,33 @@ hostname_selector () {
     return 0
 }
 
+# Reading the supported locales from /etc/locale.gen once (function).
+locale_loader () {
+    if [[ ${#locale_list[@]} -gt 0 ]]; then
+        return 0
+    fi
+    declare -gA locale_charset
+    while read -r name charset; do
+        if [[ -n "$name" ]]; then
+            locale_list+=("$name (Charset: $charset)")
+            locale_charset[$name]="$charset"
+        fi
+    done < <(sed -E '/^# +|^#$/d;s/^#//' /etc/locale.gen)
+}
+
 # User chooses the locale (function).
 locale_selector () {
-    input_print "Please insert the locale you use (format: xx_XX. Enter empty to use -en_US-, or \"/\" to search locales): " locale
+    locale_loader
+    input_print "Please insert the locale you use (format: xx_XX. Enter empty to use -en_US-, or \"/\" to search locales): "
     read -r locale
     case "$locale" in
         '') locale="en_US.UTF-8"
             info_print "$locale will be the default locale."
             return 0;;
-        '/') sed -E '/^# +|^#$/d;s/^#| *$//g;s/ .*/ (Charset:&)/' /etc/locale.gen | less -M
-                clear
+        '/') printf '%s\n' "${locale_list[@]}" | less -M
+                printf '\e[H\e[2J\e[3J'
                 return 1;;
-        *)  if ! grep -q "^#\?$(sed 's/[].*[]/\\&/g' <<< "$locale") " /etc/locale.gen; then
+        *)  if [[ -z "${locale_charset[$locale]}" ]]; then
                 error_print "The specified locale doesn't exist or isn't supported."
                 return 1
             fi
@@ -193,18 +197,31 @@ locale_selector () {
     esac
 }
 
+# Reading the console keyboard layouts once (function).
+keymap_loader () {
+    if [[ ${#keymap_list[@]} -gt 0 ]]; then
+        return 0
+    fi
+    declare -gA keymap_known
+    mapfile -t keymap_list < <(localectl list-keymaps)
+    for keymap in "${keymap_list[@]}"; do
+        keymap_known[$keymap]=1
+    done
+}
+
 # User chooses the console keyboard layout (function).
 keyboard_selector () {
+    keymap_loader
     input_print "Please insert the keyboard layout (empty to use -US-, or \"/\" to look up for keyboard layouts): "
     read -r kblayout
     case "$kblayout" in
         '') kblayout="us"
             info_print "The standard US keyboard layout will be used."
             return 0;;
-        '/') localectl list-keymaps
-             clear
+        '/') printf '%s\n' "${keymap_list[@]}" | less -M
+             printf '\e[H\e[2J\e[3J'
              return 1;;
-        *) if ! localectl list-keymaps | grep -Fxq "$kblayout"; then
+        *) if [[ -z "${keymap_known[$kblayout]}" ]]; then
                error_print "The specified keymap doesn't exist."
                return 1
            fi
@@ -214,18 +231,19 @@ keyboard_selector () {
     esac
 }
 
-intro_print "===================================================="
-intro_print " Welcome to == P U R E - A R C H == server installer"
-intro_print "===================================================="
-intro_print " "
+intro_print "====================================================" \
+            " Welcome to == P U R E - A R C H == server installer" \
+            "====================================================" \
+            " "
 ## user input ##
 
 # Choosing the target for the installation.
 info_print "Available disks for the installation:"
+mapfile -t disks < <(lsblk --nodeps --paths --noheadings --output NAME,SIZE,MODEL --filter 'TYPE == "disk"')
 PS3="Please select the number of the corresponding disk (e.g. 1): "
-select ENTRY in $(lsblk -dpnoNAME|grep -P "/dev/sd|nvme|vd");
+select ENTRY in "${disks[@]}";
 do
-    DISK="$ENTRY"
+    DISK="${ENTRY%% *}"
     info_print "Pure Arch will be installed on the following disk: $DISK"
     break
 done
@@ -263,49 +281,49 @@ if [[ ! ("$response" =~ ^(yes|y)$) ]]; then
 fi
 
 ## installation ##
-clear
-intro_print "==========================================="
-intro_print " Installing == P U R E - A R C H == server "
-intro_print "==========================================="
-intro_print " "
+printf '\e[H\e[2J\e[3J'
+intro_print "===========================================" \
+            " Installing == P U R E - A R C H == server " \
+            "===========================================" \
+            " "
 
 # Speed-up the pacman download
 info_print "Configuring pacman"
 sed -Ei 's/^#(Color)$/\1\nILoveCandy/;s/^#(ParallelDownloads).*/\1 = 10/' /etc/pacman.conf
 
 # Updating the live environment usually causes more problems than its worth, and quite often can't be done without remounting cowspace with more capacity, especially at the end of any given month.
-info_print "Updating pacman repository"
-pacman -Sy &>/dev/null
+# Installing curl in the same pacman run, --needed skips it when the ISO already ships it.
+info_print "Updating pacman repository and installing curl"
+pacman -Sy --needed --noconfirm curl &>/dev/null
 
-# Installing curl
-info_print "Installing curl"
-pacman -S --noconfirm curl &>/dev/null
+# Looking up the timezone in the background while the disk is prepared.
+curl -s http://ip-api.com/line?fields=timezone > /tmp/timezone &
+timezone_lookup=$!
 
 # formatting the disk
 info_print "Formatting disk"
 wipefs -af "$DISK" &>/dev/null
-sgdisk -Zo "$DISK" &>/dev/null
 
 # Checking the microcode to install.
-info_print "Checking microcode"
-CPU=$(grep vendor_id /proc/cpuinfo)
-if [[ $CPU == *"AuthenticAMD"* ]]; then
-    microcode=amd-ucode
-else
-    microcode=intel-ucode
-fi
+microcode_detector
 
 # Creating a new partition scheme.
 info_print "Creating new partition scheme on $DISK."
-parted -s "$DISK" \
-    mklabel gpt \
-    mkpart ESP fat32 1MiB 128MiB \
-    set 1 esp on \
-    mkpart cryptroot 128MiB 100% \
+sfdisk --wipe always "$DISK" &>/dev/null << 'EOF'
+label: gpt
+size=127MiB, type=U, name=ESP
+type=L, name=cryptroot
+EOF
 
 sleep 0.1
-ESP="/dev/$(lsblk $DISK -o NAME,PARTLABEL | grep ESP| cut -d " " -f1 | cut -c7-)"
-cryptroot="/dev/$(lsblk $DISK -o NAME,PARTLABEL | grep cryptroot | cut -d " " -f1 | cut -c7-)"
+while read -r name partlabel; do
+    case $partlabel in
+        ESP )       ESP="$name"
+                    ;;
+        cryptroot ) cryptroot="$name"
+                    ;;
+    esac
+done < <(lsblk --list --noheadings --paths --output NAME,PARTLABEL "$DISK")
 
 # Informing the Kernel of the changes.
 info_print "Informing the Kernel about the disk changes."
@@ -325,48 +343,20 @@ BTRFS="/dev/mapper/cryptroot"
 
 # Formatting the LUKS Container as BTRFS.
 info_print "Formatting the LUKS container as BTRFS."
-mkfs.btrfs $BTRFS &>/dev/null
+mkfs.btrfs --nodiscard $BTRFS &>/dev/null
 mount -o clear_cache,nospace_cache $BTRFS /mnt
 
 # Creating BTRFS subvolumes.
 info_print "Creating BTRFS subvolumes."
-btrfs su cr /mnt/@ &>/dev/null
-btrfs su cr /mnt/@/.snapshots &>/dev/null
+btrfs su cr /mnt/@ /mnt/@/.snapshots &>/dev/null
 mkdir -p /mnt/@/.snapshots/1 &>/dev/null
-btrfs su cr /mnt/@/.snapshots/1/snapshot &>/dev/null
-btrfs su cr /mnt/@/boot/ &>/dev/null
-btrfs su cr /mnt/@/home &>/dev/null
-btrfs su cr /mnt/@/root &>/dev/null
-btrfs su cr /mnt/@/srv &>/dev/null
-btrfs su cr /mnt/@/var_log &>/dev/null
-btrfs su cr /mnt/@/var_log_journal &>/dev/null
-btrfs su cr /mnt/@/var_crash &>/dev/null
-btrfs su cr /mnt/@/var_cache &>/dev/null
-btrfs su cr /mnt/@/var_tmp &>/dev/null
-btrfs su cr /mnt/@/var_spool &>/dev/null
-btrfs su cr /mnt/@/var_lib_libvirt_images &>/dev/null
-btrfs su cr /mnt/@/var_lib_machines &>/dev/null
-btrfs su cr /mnt/@/var_lib_gdm &>/dev/null
-btrfs su cr /mnt/@/var_lib_AccountsService &>/dev/null
-btrfs su cr /mnt/@/cryptkey &>/dev/null
-
-chattr +C /mnt/@/boot
-chattr +C /mnt/@/srv
-chattr +C /mnt/@/var_log
-chattr +C /mnt/@/var_log_journal
-chattr +C /mnt/@/var_crash
-chattr +C /mnt/@/var_cache
-chattr +C /mnt/@/var_tmp
-chattr +C /mnt/@/var_spool
-chattr +C /mnt/@/var_lib_libvirt_images
-chattr +C /mnt/@/var_lib_machines
-chattr +C /mnt/@/var_lib_gdm
-chattr +C /mnt/@/var_lib_AccountsService
-chattr +C /mnt/@/cryptkey
+btrfs su cr /mnt/@/.snapshots/1/snapshot /mnt/@/{boot,home,root,srv,var_log,var_log_journal,var_crash,var_cache,var_tmp,var_spool,var_lib_libvirt_images,var_lib_machines,var_lib_gdm,var_lib_AccountsService,cryptkey} &>/dev/null
+
+chattr +C /mnt/@/{boot,srv,var_log,var_log_journal,var_crash,var_cache,var_tmp,var_spool,var_lib_libvirt_images,var_lib_machines,var_lib_gdm,var_lib_AccountsService,cryptkey}
 
 #Set the default BTRFS Subvol to Snapshot 1 before pacstrapping
 info_print "Set the default BTRFS subvol to Snapshot 1"
-btrfs subvolume set-default "$(btrfs subvolume list /mnt | grep "@/.snapshots/1/snapshot" | grep -oP '(?<=ID )[0-9]+')" /mnt
+btrfs subvolume set-default /mnt/@/.snapshots/1/snapshot
 
 cat << EOF >> /mnt/@/.snapshots/1/info.xml
 <?xml version="1.0"?>
@@ -385,28 +375,33 @@ chmod 600 /mnt/@/.snapshots/1/info.xml
 info_print "Mounting the newly created subvolumes."
 umount /mnt
 mount -o ssd,noatime,space_cache,compress=zstd:15 $BTRFS /mnt
-mkdir -p /mnt/{boot,root,home,.snapshots,srv,tmp,/var/log,/var/crash,/var/cache,/var/tmp,/var/spool,/var/lib/libvirt/images,/var/lib/machines,/var/lib/gdm,/var/lib/AccountsService,/cryptkey}
-mount -o ssd,noatime,space_cache=v2,autodefrag,compress=zstd:15,discard=async,nodev,nosuid,noexec,subvol=@/boot $BTRFS /mnt/boot
-mount -o ssd,noatime,space_cache=v2,autodefrag,compress=zstd:15,discard=async,nodev,nosuid,subvol=@/root $BTRFS /mnt/root
-mount -o ssd,noatime,space_cache=v2,autodefrag,compress=zstd:15,discard=async,nodev,nosuid,subvol=@/home $BTRFS /mnt/home
-mount -o ssd,noatime,space_cache=v2,autodefrag,compress=zstd:15,discard=async,subvol=@/.snapshots $BTRFS /mnt/.snapshots
-mount -o ssd,noatime,space_cache=v2,autodefrag,compress=zstd:15,discard=async,subvol=@/srv $BTRFS /mnt/srv
-mount -o ssd,noatime,space_cache=v2,autodefrag,compress=zstd:15,discard=async,nodatacow,nodev,nosuid,noexec,subvol=@/var_log $BTRFS /mnt/var/log
-
-# Toolbox (https://github.com/containers/toolbox) needs /var/log/journal to have dev, suid, and exec, Thus I am splitting the subvolume. Need to make the directory after /mnt/var/log/ has been mounted.
-mkdir -p /mnt/var/log/journal
-mount -o ssd,noatime,space_cache=v2,autodefrag,compress=zstd:15,discard=async,nodatacow,subvol=@/var_log_journal $BTRFS /mnt/var/log/journal
-
-mount -o ssd,noatime,space_cache=v2,autodefrag,compress=zstd:15,discard=async,nodatacow,nodev,nosuid,noexec,subvol=@/var_crash $BTRFS /mnt/var/crash
-mount -o ssd,noatime,space_cache=v2,autodefrag,compress=zstd:15,discard=async,nodatacow,nodev,nosuid,noexec,subvol=@/var_cache $BTRFS /mnt/var/cache
-mount -o ssd,noatime,space_cache=v2,autodefrag,compress=zstd:15,discard=async,nodatacow,nodev,nosuid,noexec,subvol=@/var_tmp $BTRFS /mnt/var/tmp
-
-mount -o ssd,noatime,space_cache=v2,autodefrag,compress=zstd:15,discard=async,nodatacow,nodev,nosuid,noexec,subvol=@/var_spool $BTRFS /mnt/var/spool
-mount -o ssd,noatime,space_cache=v2,autodefrag,compress=zstd:15,discard=async,nodatacow,nodev,nosuid,noexec,subvol=@/var_lib_libvirt_images $BTRFS /mnt/var/lib/libvirt/images
-mount -o ssd,noatime,space_cache=v2,autodefrag,compress=zstd:15,discard=async,nodatacow,nodev,nosuid,noexec,subvol=@/var_lib_machines $BTRFS /mnt/var/lib/machines
-
-# The encryption is splitted as we do not want to include it in the backup with snap-pac.
-mount -o ssd,noatime,space_cache=v2,autodefrag,compress=zstd:15,discard=async,nodatacow,nodev,nosuid,noexec,subvol=@/cryptkey $BTRFS /mnt/cryptkey
+mkdir -p /mnt/{tmp,var/lib/gdm,var/lib/AccountsService}
+
+# Mount options shared by every subvolume, followed by the subvolume, its mountpoint and its own options.
+BTRFS_OPTIONS="ssd,noatime,space_cache=v2,autodefrag,compress=zstd:15,discard=async"
+subvolume_mounts=(
+    "@/boot                    /mnt/boot                     nodev,nosuid,noexec"
+    "@/root                    /mnt/root                     nodev,nosuid"
+    "@/home                    /mnt/home                     nodev,nosuid"
+    "@/.snapshots              /mnt/.snapshots"
+    "@/srv                     /mnt/srv"
+    "@/var_log                 /mnt/var/log                  nodatacow,nodev,nosuid,noexec"
+    # Toolbox (https://github.com/containers/toolbox) needs /var/log/journal to have dev, suid, and exec, Thus I am splitting the subvolume. It has to be mounted after /mnt/var/log.
+    "@/var_log_journal         /mnt/var/log/journal          nodatacow"
+    "@/var_crash               /mnt/var/crash                nodatacow,nodev,nosuid,noexec"
+    "@/var_cache               /mnt/var/cache                nodatacow,nodev,nosuid,noexec"
+    "@/var_tmp                 /mnt/var/tmp                  nodatacow,nodev,nosuid,noexec"
+    "@/var_spool               /mnt/var/spool                nodatacow,nodev,nosuid,noexec"
+    "@/var_lib_libvirt_images  /mnt/var/lib/libvirt/images   nodatacow,nodev,nosuid,noexec"
+    "@/var_lib_machines        /mnt/var/lib/machines         nodatacow,nodev,nosuid,noexec"
+    # The encryption is splitted as we do not want to include it in the backup with snap-pac.
+    "@/cryptkey                /mnt/cryptkey                 nodatacow,nodev,nosuid,noexec"
+)
+for entry in "${subvolume_mounts[@]}"; do
+    read -r subvolume mountpoint options <<< "$entry"
+    mkdir -p "$mountpoint"
+    mount -o "${BTRFS_OPTIONS}${options:+,$options},subvol=$subvolume" $BTRFS "$mountpoint"
+done
 
 mkdir -p /mnt/boot/efi
 mount -o nodev,nosuid,noexec $ESP /mnt/boot/efi
@@ -441,14 +436,20 @@ mount -o nodev,nosuid,noexec $ESP /mnt/boot/efi
 # "chezmoi" dotfile management
 # "rbw" bitwarden password client
 info_print "Installing the base system, please wait ..."
-pacstrap /mnt base ${kernel} ${microcode} linux-firmware btrfs-progs grub grub-btrfs snapper snap-pac inotify-tools efibootmgr sudo networkmanager apparmor firewalld zram-generator reflector openssh chrony fwupd man git gnupg rbw chezmoi mg git wget curl&>/dev/null
+packages=(
+    base "$kernel" "$microcode" linux-firmware btrfs-progs
+    grub grub-btrfs snapper snap-pac inotify-tools efibootmgr
+    sudo networkmanager apparmor firewalld zram-generator reflector openssh chrony fwupd
+    man git gnupg rbw chezmoi mg wget curl
+)
+pacstrap /mnt "${packages[@]}" &>/dev/null
 
 # Generating /etc/fstab.
 info_print "Generating a new fstab."
 genfstab -U /mnt >> /mnt/etc/fstab
 sed -i 's#,subvolid=258,subvol=/@/.snapshots/1/snapshot,subvol=@/.snapshots/1/snapshot##g' /mnt/etc/fstab
 
-info_print "Setting hostname to $hostame"
+info_print "Setting hostname to $hostname"
 echo "$hostname" > /mnt/etc/hostname
 
 # Setting hosts file.
@@ -473,34 +474,38 @@ info_print "Setting pacman configuration."
 sed -Ei 's/^#(Color)$/\1\nILoveCandy/;s/^#(ParallelDownloads).*/\1 = 10/' /mnt/etc/pacman.conf
 
 # Configuring /etc/mkinitcpio.conf
-info_print "Configuring /etc/mkinitcpio for ZSTD compression and LUKS hook."
-sed -i 's,#COMPRESSION="zstd",COMPRESSION="zstd",g' /mnt/etc/mkinitcpio.conf
-sed -i 's,HOOKS=(base udev autodetect microcode modconf kms keyboard keymap consolefont block filesystems fsck),HOOKS=(base udev autodetect microcode modconf kms keyboard keymap consolefont block encrypt filesystems fsck),g' /mnt/etc/mkinitcpio.conf
-
-# Enabling LUKS in GRUB and setting the UUID of the LUKS container.
-UUID=$(blkid $cryptroot | cut -f2 -d'"')
-sed -i 's/#\(GRUB_ENABLE_CRYPTODISK=y\)/\1/' /mnt/etc/default/grub
-echo "" >> /mnt/etc/default/grub
-echo -e "# Booting with BTRFS subvolume\nGRUB_BTRFS_OVERRIDE_BOOT_PARTITION_DETECTION=true" >> /mnt/etc/default/grub
-sed -i 's#rootflags=subvol=${rootsubvol}##g' /mnt/etc/grub.d/10_linux
-sed -i 's#rootflags=subvol=${rootsubvol}##g' /mnt/etc/grub.d/20_linux_xen
+info_print "Configuring /etc/mkinitcpio for ZSTD compression, LUKS hook and keyfile."
+sed -i -e 's,#COMPRESSION="zstd",COMPRESSION="zstd",g' \
+       -e 's,HOOKS=(base udev autodetect microcode modconf kms keyboard keymap consolefont block filesystems fsck),HOOKS=(base udev autodetect microcode modconf kms keyboard keymap consolefont block encrypt filesystems fsck),g' \
+       -e 's#FILES=()#FILES=(/cryptkey/.root.key)#g' \
+       /mnt/etc/mkinitcpio.conf
+
+# Enabling LUKS in GRUB and setting the kernel command line with the UUID of the LUKS container.
+UUID=$(blkid --match-tag UUID --output value "$cryptroot")
+sed -i -e 's/#\(GRUB_ENABLE_CRYPTODISK=y\)/\1/' \
+       -e "s#quiet#cryptdevice=UUID=$UUID:cryptroot root=$BTRFS lsm=landlock,lockdown,yama,apparmor,bpf cryptkey=rootfs:/cryptkey/.root.key#g" \
+       /mnt/etc/default/grub
+cat >> /mnt/etc/default/grub <<'EOF'
+
+# Booting with BTRFS subvolume
+GRUB_BTRFS_OVERRIDE_BOOT_PARTITION_DETECTION=true
+EOF
+sed -i 's#rootflags=subvol=${rootsubvol}##g' /mnt/etc/grub.d/10_linux /mnt/etc/grub.d/20_linux_xen
 
 info_print "Securing Linux"
-# Enabling CPU Mitigations
-info_print "... Enabling CPU mitigation."
-curl https://raw.githubusercontent.com/Kicksecure/security-misc/master/etc/default/grub.d/40_cpu_mitigations.cfg -o /mnt/etc/grub.d/40_cpu_mitigations.cfg &>/dev/null
-
-# Distrusting the CPU
-info_print "... Distrusting the CPU."
-curl https://raw.githubusercontent.com/Kicksecure/security-misc/master/etc/default/grub.d/40_distrust_cpu.cfg -o /mnt/etc/grub.d/40_distrust_cpu.cfg &>/dev/null
-
-# Enabling IOMMU
-info_print "... Enabling IOMMU."
-curl https://raw.githubusercontent.com/Kicksecure/security-misc/master/etc/default/grub.d/40_enable_iommu.cfg -o /mnt/etc/grub.d/40_enable_iommu.cfg &>/dev/null
-
-# Enabling NTS
-info_print "... Enabling NTS."
-curl https://raw.githubusercontent.com/GrapheneOS/infrastructure/main/chrony.conf -o /mnt/etc/chrony.conf &>/dev/null
+# Downloading the hardening configuration in one parallel transfer:
+# CPU mitigations, distrusting the CPU, IOMMU, NTS, kernel module blacklist and kernel settings.
+info_print "... Enabling CPU mitigation, distrusting the CPU, enabling IOMMU and NTS."
+curl --parallel \
+    -o /mnt/etc/grub.d/40_cpu_mitigations.cfg https://raw.githubusercontent.com/Kicksecure/security-misc/master/etc/default/grub.d/40_cpu_mitigations.cfg \
+    -o /mnt/etc/grub.d/40_distrust_cpu.cfg https://raw.githubusercontent.com/Kicksecure/security-misc/master/etc/default/grub.d/40_distrust_cpu.cfg \
+    -o /mnt/etc/grub.d/40_enable_iommu.cfg https://raw.githubusercontent.com/Kicksecure/security-misc/master/etc/default/grub.d/40_enable_iommu.cfg \
+    -o /mnt/etc/chrony.conf https://raw.githubusercontent.com/GrapheneOS/infrastructure/main/chrony.conf \
+    -o /mnt/etc/modprobe.d/30_security-misc.conf https://raw.githubusercontent.com/Kicksecure/security-misc/master/etc/modprobe.d/30_security-misc.conf \
+    -o /mnt/etc/sysctl.d/990-security-misc.conf https://raw.githubusercontent.com/Kicksecure/security-misc/master/usr/lib/sysctl.d/990-security-misc.conf \
+    -o /mnt/etc/sysctl.d/30_silent-kernel-printk.conf https://raw.githubusercontent.com/Kicksecure/security-misc/master/etc/sysctl.d/30_silent-kernel-printk.conf \
+    -o /mnt/etc/sysctl.d/30_security-misc_kexec-disable.conf https://raw.githubusercontent.com/Kicksecure/security-misc/master/etc/sysctl.d/30_security-misc_kexec-disable.conf \
+    &>/dev/null
 
 # Setting GRUB configuration file permissions
 info_print "... Setting GRUB configuration permissions."
@@ -512,25 +517,19 @@ dd bs=512 count=4 if=/dev/random of=/mnt/cryptkey/.root.key iflag=fullblock &>/d
 chmod 000 /mnt/cryptkey/.root.key &>/dev/null
 echo -n "$password" | cryptsetup -v luksAddKey /dev/disk/by-partlabel/cryptroot /mnt/cryptkey/.root.key -d - &>/dev/null
 
-sed -i "s#quiet#cryptdevice=UUID=$UUID:cryptroot root=$BTRFS lsm=landlock,lockdown,yama,apparmor,bpf cryptkey=rootfs:/cryptkey/.root.key#g" /mnt/etc/default/grub
-sed -i 's#FILES=()#FILES=(/cryptkey/.root.key)#g' /mnt/etc/mkinitcpio.conf
-
 # Configure AppArmor Parser caching
 info_print "... Configuring AppArmor parser caching."
-sed -i 's/#write-cache/write-cache/g' /mnt/etc/apparmor/parser.conf
-sed -i 's,#Include /etc/apparmor.d/,Include /etc/apparmor.d/,g' /mnt/etc/apparmor/parser.conf
+sed -i -e 's/#write-cache/write-cache/g' \
+       -e 's,#Include /etc/apparmor.d/,Include /etc/apparmor.d/,g' \
+       /mnt/etc/apparmor/parser.conf
 
 # Blacklisting kernel modules
 info_print "... Blacklisting kernel modules."
-curl https://raw.githubusercontent.com/Kicksecure/security-misc/master/etc/modprobe.d/30_security-misc.conf -o /mnt/etc/modprobe.d/30_security-misc.conf &>/dev/null
 chmod 600 /mnt/etc/modprobe.d/*
 
 # Security kernel settings.
 info_print "... Securing kernel settings"
-curl https://raw.githubusercontent.com/Kicksecure/security-misc/master/usr/lib/sysctl.d/990-security-misc.conf -o /mnt/etc/sysctl.d/990-security-misc.conf &>/dev/null
 sed -i 's/kernel.yama.ptrace_scope=2/kernel.yama.ptrace_scope=3/g' /mnt/etc/sysctl.d/990-security-misc.conf
-curl https://raw.githubusercontent.com/Kicksecure/security-misc/master/etc/sysctl.d/30_silent-kernel-printk.conf -o /mnt/etc/sysctl.d/30_silent-kernel-printk.conf &>/dev/null
-curl https://raw.githubusercontent.com/Kicksecure/security-misc/master/etc/sysctl.d/30_security-misc_kexec-disable.conf -o /mnt/etc/sysctl.d/30_security-misc_kexec-disable.conf &>/dev/null
 chmod 600 /mnt/etc/sysctl.d/*
 
 # Remove nullok from system-auth
@@ -543,7 +542,7 @@ echo "* hard core 0" >> /mnt/etc/security/limits.conf
 
 # Disable su for non-wheel users
 info_print "... Disabling su for non-wheel users."
-bash -c 'cat > /mnt/etc/pam.d/su' <<-'EOF'
+cat > /mnt/etc/pam.d/su <<-'EOF'
 #%PAM-1.0
 auth		sufficient	pam_rootok.so
 # Uncomment the following line to implicitly trust users in the "wheel" group.
@@ -560,39 +559,39 @@ info_print "Configuring the system - chroot"
 
 # ZRAM configuration
 info_print "... Configuring zram."
-bash -c 'cat > /mnt/etc/systemd/zram-generator.conf' <<-'EOF'
+cat > /mnt/etc/systemd/zram-generator.conf <<-'EOF'
 [zram0]
 zram-fraction = 1
 max-zram-size = 8192
 EOF
 
 info_print "... Configuring timezone."
-arch-chroot /mnt ln -sf /usr/share/zoneinfo/$(curl -s http://ip-api.com/line?fields=timezone) /etc/localtime &>/dev/null
-
-info_print "... Configuring clock."
-arch-chroot /mnt hwclock --systohc
-
-info_print "... Configuring locales."
-arch-chroot /mnt locale-gen &>/dev/null
+wait "$timezone_lookup" || true
+read -r timezone < /tmp/timezone || true
+ln -sf "/usr/share/zoneinfo/$timezone" /mnt/etc/localtime &>/dev/null
+
+info_print "... Configuring clock and locales."
+arch-chroot /mnt /bin/bash -e <<'EOF'
+    hwclock --systohc
+    locale-gen &>/dev/null
+EOF
 
 info_print "... Adding $username with root privilege."
 if [ -n "$username" ]; then
-    arch-chroot /mnt useradd -m $username
-    arch-chroot /mnt usermod -aG wheel $username
-
-    arch-chroot /mnt groupadd -r audit
-    arch-chroot /mnt gpasswd -a $username audit &>/dev/null
-fi
-
-# Setting user password.
-if [[ -n "$username" ]]; then
-    info_print "... Setting $username password."
-    echo "$username:$userpass" | arch-chroot /mnt chpasswd
+    arch-chroot /mnt /bin/bash -e -s -- "$username" <<'EOF'
+    groupadd -r audit
+    useradd -m -G wheel,audit "$1"
+EOF
 fi
 
-# Setting root password.
-info_print "... Setting root password."
-echo "root:$rootpass" | arch-chroot /mnt chpasswd
+# Setting user and root passwords in one chpasswd call.
+info_print "... Setting ${username:+$username and }root password."
+{
+    if [[ -n "$username" ]]; then
+        printf '%s:%s\n' "$username" "$userpass"
+    fi
+    printf 'root:%s\n' "$rootpass"
+} | arch-chroot /mnt chpasswd
 
 # Giving wheel user sudo access.
 info_print "... Setting user sudo access."
@@ -602,22 +601,18 @@ sed -i 's/# \(%wheel ALL=(ALL\(:ALL\|\)) ALL\)/\1/g' /mnt/etc/sudoers
 info_print "... Adding audit to logging group."
 echo "log_group = audit" >> /mnt/etc/audit/auditd.conf
 
-# Generating a new initramfs.
-info_print "... Create ram disk for kernel modules."
+# Generating a new initramfs, installing GRUB on /boot and writing its config file.
+info_print "... Create ram disk for kernel modules, installing and configuring GRUB."
 chmod 600 /mnt/boot/initramfs-linux*
-arch-chroot /mnt mkinitcpio -P &>/dev/null
-
-info_print "... Installing GRUB on /boot."
-arch-chroot /mnt grub-install --target=x86_64-efi --efi-directory=/boot/efi --bootloader-id=GRUB --modules="normal test efi_gop efi_uga search echo linux all_video gfxmenu gfxterm_background gfxterm_menu gfxterm loadenv configfile gzio part_gpt cryptodisk luks gcry_rijndael gcry_sha256 btrfs" --disable-shim-lock &>/dev/null
-
-info_print "... Configuring GRUB config file."
-arch-chroot /mnt grub-mkconfig -o /boot/grub/grub.cfg &>/dev/null
+arch-chroot /mnt /bin/bash -e <<'EOF' &>/dev/null
+    mkinitcpio -P
+    grub-install --target=x86_64-efi --efi-directory=/boot/efi --bootloader-id=GRUB --modules="normal test efi_gop efi_uga search echo linux all_video gfxmenu gfxterm_background gfxterm_menu gfxterm loadenv configfile gzio part_gpt cryptodisk luks gcry_rijndael gcry_sha256 btrfs" --disable-shim-lock
+    grub-mkconfig -o /boot/grub/grub.cfg
+EOF
 
-# info_print "... Configuring snapshots."
+# Snapper configuration
+info_print "... Configuring snapshots."
 arch-chroot /mnt /bin/bash -e <<EOF
-
-    # Snapper configuration
-    echo -e "${BOLD}${BGREEN}[ ${BYELLOW}•${BGREEN} ] ... Configuring snapshots.${RESET}"
     umount /.snapshots
     rm -r /.snapshots
     snapper --no-dbus -c root create-config /
@@ -629,63 +624,41 @@ EOF
 
 info_print "Enabling services"
 
-# Enabling audit service.
-info_print "... Enabling audit deamon service"
-systemctl enable auditd --root=/mnt &>/dev/null
-
-# Enabling openssh server
-info_print "... Enabling openssh service"
-systemctl enable sshd --root=/mnt &>/dev/null
-
-# Enabling auto-trimming service.
-info_print "... Enabling trimming service"
-systemctl enable fstrim.timer --root=/mnt &>/dev/null
-
-# Enabling NetworkManager.
-info_print "... Enabling network manager service"
-systemctl enable NetworkManager --root=/mnt &>/dev/null
-
-# Enabling AppArmor.
-info_print "... Enabling apparmor service"
-systemctl enable apparmor --root=/mnt &>/dev/null
-
-# Enabling Firewalld.
-info_print "... Enabling firewalld service"
-systemctl enable firewalld --root=/mnt &>/dev/null
-
-# Enabling Reflector timer.
-info_print "... Enabling reflector service"
-systemctl enable reflector.timer --root=/mnt &>/dev/null
-
-# Enabling systemd-oomd.
-info_print "... Enabling oom daemon"
-systemctl enable systemd-oomd --root=/mnt &>/dev/null
+# Enabling services and timers in one systemctl call.
+services=(
+    auditd                  # Audit daemon
+    sshd                    # Openssh server
+    fstrim.timer            # Auto-trimming
+    NetworkManager          # Network manager
+    apparmor                # AppArmor
+    firewalld               # Firewalld
+    reflector.timer         # Reflector
+    systemd-oomd            # OOM daemon
+    chronyd                 # Chrony daemon
+    snapper-timeline.timer  # Snapper automatic snapshots
+    snapper-cleanup.timer
+    grub-btrfsd
+)
+info_print "... Enabling audit, openssh, trimming, network manager, apparmor, firewalld, reflector, oom, chrony and snapper services"
+systemctl enable "${services[@]}" --root=/mnt &>/dev/null
 
 # Disabling systemd-timesyncd
 info_print "... Disabling timesync daemon"
 systemctl disable systemd-timesyncd --root=/mnt &>/dev/null
 
-# Enabling chronyd
-info_print "... Enabling chrony daemon"
-systemctl enable chronyd --root=/mnt &>/dev/null
-
-# Enabling Snapper automatic snapshots.
-info_print "... Enabling snapper service"
-systemctl enable snapper-timeline.timer --root=/mnt &>/dev/null
-systemctl enable snapper-cleanup.timer --root=/mnt &>/dev/null
-systemctl enable grub-btrfsd --root=/mnt &>/dev/null
-
 # Setting umask to 077.
 info_print "umask to 077"
 sed -i 's/022/077/g' /mnt/etc/profile
-echo "" >> /mnt/etc/bash.bashrc
-echo "umask 077" >> /mnt/etc/bash.bashrc
+cat >> /mnt/etc/bash.bashrc <<'EOF'
+
+umask 077
+EOF
 
 # Setting virtual system - if present
 virt_check
 
 # Finishing up
-intro_print " "
-intro_print "Done, you may now wish to reboot (further changes can be done by chrooting into /mnt)."
-intro_print "======================================================================================"
+intro_print " " \
+            "Done, you may now wish to reboot (further changes can be done by chrooting into /mnt)." \
+            "======================================================================================"
 exit